@@ -16,88 +16,98 @@ category_tips = {
     "Other": "Set a monthly 'misc' cap and move leftover funds to savings."
 }
 
-def _to_year_month(d):
-    return f"{d.year:04d}-{d.month:02d}"
-
-def _linear_fit_forecast(xs, ys):
+def _linear_fit_forecast(n, sum_y, sum_xy):
     """
-    Fit y = a*x + b using least squares and forecast next x.
-    xs: [0, 1, 2, ...]
-    ys: list of floats
+    Fit y = a*x + b over x = 0..n-1 using least squares and forecast x = n.
+    Only the running sums of y and x*y are needed; the x terms are closed form.
     """
-    n = len(xs)
     if n == 0:
         return 0.0
-    mean_x = sum(xs)/n
-    mean_y = sum(ys)/n
-    num = sum((x-mean_x)*(y-mean_y) for x, y in zip(xs, ys))
-    den = sum((x-mean_x)**2 for x in xs) or 1e-9
-    a = num/den
-    b = mean_y - a*mean_x
-    next_x = xs[-1] + 1
-    forecast = a*next_x + b
+    # Centered form: sum((x-mean_x)*y) = sum_xy - mean_x*sum_y, which avoids
+    # the cancellation of the raw n*sum_xy - sum_x*sum_y numerator
+    mean_x = (n-1)/2
+    sxx = n*(n*n-1)/12
+    a = (sum_xy - mean_x*sum_y)/sxx if sxx else 0.0
+    b = sum_y/n - a*mean_x
+    forecast = a*n + b
     return max(0.0, forecast)
 
-def _zscore(value, arr):
-    if not arr:
+def _zscore(value, n, total, sumsq):
+    """z-score of value against n samples, given their sum and sum of squares."""
+    if n < 2:
         return 0.0
-    mean = sum(arr)/len(arr)
-    var = sum((x-mean)**2 for x in arr)/len(arr) if len(arr) > 1 else 0.0
-    std = math.sqrt(var)
-    if std == 0:
+    mean = total/n
+    var = sumsq/n - mean*mean
+    # Equal samples cancel to rounding noise rather than exactly zero
+    if var <= 1e-12 * (sumsq/n):
         return 0.0
-    return (value - mean)/std
+    return (value - mean)/math.sqrt(var)
 
-def generate_insights(expenses):
+def generate_insights(monthly_totals):
     """
-    Input: list of Expense objects (with .date, .amount, .category)
+    Input: iterable of (category, year_month, amount_sum) rows, pre-aggregated
+           per category and month (e.g. by a SQL GROUP BY); year_month is an
+           integer year*100 + month
     Output: dict with per-category analytics and global suggestions
     """
-    if not expenses:
-        return {"summary": {"total": 0.0, "months": 0, "top_category": None},
-                "per_category": {},
-                "suggestions": ["Add expenses to unlock insights."]}
-
     # Aggregate totals
-    total = sum(e.amount for e in expenses)
-    by_cat = defaultdict(list)  # list of (date, amount)
+    total = 0.0
     by_month_cat = defaultdict(lambda: defaultdict(float))
 
-    for e in expenses:
-        by_cat[e.category].append((e.date, e.amount))
-        ym = _to_year_month(e.date)
-        by_month_cat[e.category][ym] += e.amount
+    for cat, ym, amount in monthly_totals:
+        by_month_cat[cat][ym] += amount
+        total += amount
+
+    if not by_month_cat:
+        return {"summary": {"total": 0.0, "months": 0, "top_category": None},
+                "per_category": {},
+                "suggestions": ["Add expenses to unlock insights."]}
 
     # Determine month ordering across all data
-    all_months = set()
-    for cat, mm in by_month_cat.items():
-        all_months |= set(mm.keys())
-    months_sorted = sorted(all_months)  # YYYY-MM lexicographic works
+    months_sorted = sorted({m for mm in by_month_cat.values() for m in mm})  # year*100 + month sorts chronologically
+    month_idx = {m: i for i, m in enumerate(months_sorted)}
+    n_months = len(months_sorted)
+    last_month = months_sorted[-1]
+    # The overall trend check only compares the last 6 months, and only when
+    # there are at least 6, so totals are tracked for that window alone
+    trend_start = n_months - 6 if n_months >= 6 else n_months
+    month_totals = [0.0] * (n_months - trend_start)
 
     # Per-category analytics
     per_category = {}
     top_category, top_total = None, 0.0
 
     for cat, mm in by_month_cat.items():
-        totals_series = [mm.get(m, 0.0) for m in months_sorted]
-        cat_total = sum(totals_series)
+        # One pass over the months this category has spend in: running sums
+        # for the trend fit and z-score, plus the overall monthly totals.
+        # Months without spend contribute zero to every sum.
+        n_spend = 0
+        cat_total = sum_xy = sum_sq = 0.0
+        for m, v in mm.items():
+            i = month_idx[m]
+            if i >= trend_start:
+                month_totals[i - trend_start] += v
+            cat_total += v
+            sum_xy += i*v
+            sum_sq += v*v
+            if v > 0:
+                n_spend += 1
         if cat_total > top_total:
             top_total = cat_total
             top_category = cat
 
         # Trend-based forecast
-        xs = list(range(len(months_sorted)))
-        if len([v for v in totals_series if v > 0]) >= 3:
-            forecast = _linear_fit_forecast(xs, totals_series)
+        if n_spend >= 3:
+            forecast = _linear_fit_forecast(n_months, cat_total, sum_xy)
         else:
             # Fallback: mean of available months
-            nonzeros = [v for v in totals_series if v > 0]
-            forecast = sum(nonzeros)/len(nonzeros) if nonzeros else 0.0
+            forecast = cat_total/n_spend if n_spend else 0.0
+        # Compare in cents, so float residue can't trigger a note
+        forecast = round(forecast, 2)
 
         # Last month anomaly z-score (relative to prior months)
-        last_val = totals_series[-1] if totals_series else 0.0
-        prior = totals_series[:-1] if len(totals_series) > 1 else []
-        z_last = _zscore(last_val, prior) if prior else 0.0
+        last_val = mm.get(last_month, 0.0)
+        z_last = _zscore(last_val, n_months - 1, cat_total - last_val, sum_sq - last_val*last_val)
 
         # Savings target: aim for 90% of forecast if last month exceeded forecast
         savings_target = max(0.0, round(0.9 * forecast, 2))
@@ -108,8 +118,9 @@ def generate_insights(expenses):
             rec.append(f"Stay on track in {cat}. Expected spend next month: ${forecast:.2f}.")
         if z_last >= 1.5:
             rec.append(f"Possible spike in {cat} last month (z≈{z_last:.1f}). Review big charges.")
-        if cat in category_tips:
-            rec.append(category_tips[cat])
+        tip = category_tips.get(cat)
+        if tip:
+            rec.append(tip)
 
         per_category[cat] = {
             "total": round(cat_total, 2),
@@ -127,16 +138,9 @@ def generate_insights(expenses):
         suggestions.append(f"Set a monthly soft cap for {cat} around ${data['suggested_cap']:.2f}.")
 
     # If spending trending up overall (compare last 3 months with prior 3)
-    month_totals = defaultdict(float)
-    for cat, mm in by_month_cat.items():
-        for m, v in mm.items():
-            month_totals[m] += v
-    months_sorted_total = sorted(month_totals.keys())
-    if len(months_sorted_total) >= 6:
-        recent = months_sorted_total[-3:]
-        earlier = months_sorted_total[-6:-3]
-        r_avg = sum(month_totals[m] for m in recent)/3.0
-        e_avg = sum(month_totals[m] for m in earlier)/3.0
+    if n_months >= 6:
+        r_avg = sum(month_totals[3:])/3.0
+        e_avg = sum(month_totals[:3])/3.0
         if r_avg > e_avg * 1.1:
             suggestions.append("Overall spending has risen ~10%+ in the last quarter vs the previous. Consider a temporary 5–10% cut across variable categories.")
 
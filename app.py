@@ -1,15 +1,34 @@
 #!/usr/bin/env python3
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
-from collections import defaultdict
 from flask import Flask, render_template, request, redirect, url_for, flash
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, Text
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Text, Index, event, extract, func, insert, inspect, or_, select, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base, validates
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from ai import generate_insights, category_tips
 
 Base = declarative_base()
 
+# Rows per page on the expenses listing
+PER_PAGE = 100
+
+# Background insights refreshes for every app in the process share one worker
+# thread, so app factories (e.g. in tests) don't each leave a thread behind.
+# concurrent.futures joins it at interpreter exit.
+_insights_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="insights")
+
+def _parse_ymd(s):
+    """Parse YYYY-MM-DD into a date; raises ValueError on anything else."""
+    y, m, d = s.split("-")
+    # int() alone would also take "24", "+2024", "2_024" or non-ASCII digits
+    if not (s.isascii() and len(y) == 4 and y.isdigit() and 1 <= len(m) <= 2 and m.isdigit()
+            and 1 <= len(d) <= 2 and d.isdigit()):
+        raise ValueError(f"Invalid date: {s!r}")
+    return date(int(y), int(m), int(d))
+
 class Expense(Base):
     __tablename__ = "expenses"
     id = Column(Integer, primary_key=True)
@@ -19,6 +38,37 @@ class Expense(Base):
     merchant = Column(String(128), nullable=True)
     payment_method = Column(String(64), nullable=True)
     notes = Column(Text, nullable=True)
+    # Denormalized month bucket (year*100 + month) so aggregates can group on
+    # a plain indexed column instead of calling strftime per row
+    year_month = Column(Integer, nullable=False, index=True)
+
+    __table_args__ = (
+        # Dashboard "recent" list and the listing page sort by newest first
+        Index("ix_expenses_date_desc", date.desc()),
+        # Category filter + date range on the listing page
+        Index("ix_expenses_cat_date", "category", "date"),
+    )
+
+    @validates("date")
+    def _sync_year_month(self, key, value):
+        # Keep the month bucket derived from date wherever an Expense is built.
+        # Bulk query.update(date=...) bypasses this and leaves year_month
+        # stale, so set both columns there. A missing or non-date value is
+        # left for the flush to reject with its usual error.
+        if isinstance(value, date):
+            self.year_month = value.year * 100 + value.month
+        return value
+
+class InsightsCache(Base):
+    """Latest generate_insights() result, stored as JSON in a single row."""
+    __tablename__ = "insights_cache"
+    id = Column(Integer, primary_key=True)
+    # Bumped in the same transaction as every expense add/delete, by any process
+    data_version = Column(Integer, nullable=False, default=0)
+    # data_version the payload was computed from; NULL until first computed
+    payload_version = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
 
 def create_app(test_config=None):
     app = Flask(__name__)
@@ -27,14 +77,119 @@ def create_app(test_config=None):
     app.config["DATABASE_URL"] = db_path
 
     # SQLAlchemy setup (no Flask-SQLAlchemy to keep deps minimal)
-    engine = create_engine(db_path, echo=False, future=True)
+    url = make_url(db_path)
+    engine_options = {}
+    if url.get_backend_name() != "sqlite":
+        # Server databases can drop idle connections; a local SQLite file
+        # can't, so there the ping would just add a query per checkout
+        engine_options["pool_pre_ping"] = True
+    engine = create_engine(url, echo=False, future=True, **engine_options)
+    if engine.dialect.name == "sqlite":
+        # WAL lets /insights reads run alongside writes, and synchronous=NORMAL
+        # is safe under WAL while saving an fsync per commit
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute("PRAGMA temp_store=MEMORY")
+            cur.execute("PRAGMA mmap_size=268435456")
+            cur.close()
+    # insights_cache only holds derived data; rebuild it rather than migrate it
+    insp = inspect(engine)
+    if insp.has_table("insights_cache") and \
+            {c["name"] for c in insp.get_columns("insights_cache")} != set(InsightsCache.__table__.columns.keys()):
+        InsightsCache.__table__.drop(engine)
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    # One-shot migration for databases created before year_month existed
+    if "year_month" not in {c["name"] for c in inspect(engine).get_columns("expenses")}:
+        with engine.begin() as conn:
+            # SQLite only adds a NOT NULL column with a default; every row is
+            # backfilled straight after
+            conn.execute(text("ALTER TABLE expenses ADD COLUMN year_month INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(update(Expense.__table__).values(
+                year_month=extract("year", Expense.date) * 100 + extract("month", Expense.date)))
+    # create_all skips indexes on tables that already exist
+    for idx in Expense.__table__.indexes:
+        idx.create(engine, checkfirst=True)
+    # Writes bump the version on the single insights_cache row, so it has to
+    # exist up front
+    try:
+        with engine.begin() as conn:
+            if conn.execute(select(InsightsCache.id).where(InsightsCache.id == 1)).first() is None:
+                conn.execute(insert(InsightsCache).values(id=1, data_version=0))
+    except IntegrityError:
+        pass  # another worker created it first
+    # One session per request, reused by every query in that request and
+    # released back to the pool at teardown
+    Session = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
 
-    # Utility to get a session per request
+    @app.teardown_appcontext
+    def remove_session(exc=None):
+        Session.remove()
+
+    # Utility to get the current request's session
     def get_session():
         return Session()
 
+    # Insights only change when expenses are added or deleted, so they are
+    # recomputed off the request path after each write and /insights just
+    # reads the stored result
+    pending_refresh = {}
+    # In-memory SQLite gives each thread its own private database, so a
+    # worker thread wouldn't see the app's tables; refresh inline there
+    refresh_in_background = not (url.get_backend_name() == "sqlite"
+                                 and url.database in (None, "", ":memory:"))
+
+    def bump_data_version(session):
+        session.execute(update(InsightsCache).where(InsightsCache.id == 1)
+                        .values(data_version=InsightsCache.data_version + 1))
+
+    def refresh_insights():
+        session = get_session()
+        try:
+            # Read the version first; the aggregate below sees at least that
+            version = session.execute(select(InsightsCache.data_version)
+                                      .where(InsightsCache.id == 1)).scalar_one()
+            # Stream plain row tuples straight into generate_insights; no ORM
+            # instances and no intermediate list
+            stmt = (select(Expense.category, Expense.year_month, func.sum(Expense.amount))
+                    .group_by(Expense.category, Expense.year_month)
+                    .execution_options(yield_per=1000))
+            payload = json.dumps(generate_insights(session.execute(stmt)))
+            # Never replace a payload another worker built from a newer version
+            session.execute(update(InsightsCache)
+                            .where(InsightsCache.id == 1,
+                                   or_(InsightsCache.payload_version.is_(None),
+                                       InsightsCache.payload_version < version))
+                            .values(payload=payload, payload_version=version,
+                                    updated_at=datetime.utcnow()))
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        return payload
+
+    def refresh_insights_task():
+        try:
+            refresh_insights()
+        except Exception:
+            app.logger.exception("Background insights refresh failed")
+            raise
+        finally:
+            # Worker threads get their own scoped session; release it here
+            Session.remove()
+
+    def schedule_insights_refresh():
+        if refresh_in_background:
+            pending_refresh["future"] = _insights_executor.submit(refresh_insights_task)
+            return
+        try:
+            refresh_insights()
+        except Exception:
+            # The write itself succeeded; /insights recomputes on its next view
+            app.logger.exception("Insights refresh failed")
+
     @app.context_processor
     def inject_now():
         return {"now": datetime.utcnow()}
@@ -42,64 +197,71 @@ def create_app(test_config=None):
     @app.route("/")
     def index():
         session = get_session()
-        try:
-            expenses = session.query(Expense).order_by(Expense.date.desc()).limit(10).all()
-            totals = session.query(Expense).all()
-
-            total_spend = sum(e.amount for e in totals)
-            by_category = defaultdict(float)
-            by_month = defaultdict(float)
-            for e in totals:
-                by_category[e.category] += e.amount
-                ym = e.date.strftime("%Y-%m")
-                by_month[ym] += e.amount
-
-            categories = list(by_category.keys())
-            cat_values = [round(by_category[c], 2) for c in categories]
-
-            months_sorted = sorted(by_month.keys())
-            month_values = [round(by_month[m], 2) for m in months_sorted]
-
-            return render_template(
-                "index.html",
-                expenses=expenses,
-                total_spend=round(total_spend, 2),
-                categories=categories,
-                cat_values=cat_values,
-                months=months_sorted,
-                month_values=month_values,
-            )
-        finally:
-            session.close()
+        # Plain column rows (attribute access still works in the template);
+        # no ORM instances to build or track for display-only data
+        expenses = (session.query(Expense.date, Expense.category, Expense.merchant, Expense.amount)
+                    .order_by(Expense.date.desc()).limit(10).all())
+
+        # Let the DB do the summing; only a handful of rows come back
+        by_category = (session.query(Expense.category, func.sum(Expense.amount))
+                       .group_by(Expense.category).all())
+        by_month = (session.query(Expense.year_month, func.sum(Expense.amount))
+                    .group_by(Expense.year_month).order_by(Expense.year_month).all())
+
+        total_spend = sum(v for _, v in by_category)
+        categories = [c for c, _ in by_category]
+        cat_values = [round(v, 2) for _, v in by_category]
+
+        months_sorted = [f"{m // 100:04d}-{m % 100:02d}" for m, _ in by_month]
+        month_values = [round(v, 2) for _, v in by_month]
+
+        return render_template(
+            "index.html",
+            expenses=expenses,
+            total_spend=round(total_spend, 2),
+            categories=categories,
+            cat_values=cat_values,
+            months=months_sorted,
+            month_values=month_values,
+        )
 
     @app.route("/expenses")
     def list_expenses():
         session = get_session()
-        try:
-            q = session.query(Expense)
-            category = request.args.get("category", "").strip()
-            start = request.args.get("start", "").strip()
-            end = request.args.get("end", "").strip()
-            if category:
-                q = q.filter(Expense.category == category)
-            if start:
-                try:
-                    d = datetime.strptime(start, "%Y-%m-%d").date()
-                    q = q.filter(Expense.date >= d)
-                except ValueError:
-                    flash("Invalid start date format. Use YYYY-MM-DD.", "warning")
-            if end:
-                try:
-                    d = datetime.strptime(end, "%Y-%m-%d").date()
-                    q = q.filter(Expense.date <= d)
-                except ValueError:
-                    flash("Invalid end date format. Use YYYY-MM-DD.", "warning")
+        filters = []
+        category = request.args.get("category", "").strip()
+        start = request.args.get("start", "").strip()
+        end = request.args.get("end", "").strip()
+        page = max(request.args.get("page", 1, type=int), 1)
+        if category:
+            filters.append(Expense.category == category)
+        if start:
+            try:
+                d = _parse_ymd(start)
+                filters.append(Expense.date >= d)
+            except ValueError:
+                flash("Invalid start date format. Use YYYY-MM-DD.", "warning")
+        if end:
+            try:
+                d = _parse_ymd(end)
+                filters.append(Expense.date <= d)
+            except ValueError:
+                flash("Invalid end date format. Use YYYY-MM-DD.", "warning")
 
-            expenses = q.order_by(Expense.date.desc(), Expense.id.desc()).all()
-            total = round(sum(e.amount for e in expenses), 2)
-            return render_template("expenses.html", expenses=expenses, total=total, category=category, start=start, end=end)
-        finally:
-            session.close()
+        # Count and total over the whole filtered set in one SQL aggregate;
+        # only the current page of rows is loaded
+        count, total = (session.query(func.count(Expense.id), func.sum(Expense.amount))
+                        .filter(*filters).one())
+        total = round(total or 0.0, 2)
+        pages = max((count + PER_PAGE - 1) // PER_PAGE, 1)
+        page = min(page, pages)
+        expenses = (session.query(Expense.id, Expense.date, Expense.category, Expense.merchant,
+                                  Expense.payment_method, Expense.amount)
+                    .filter(*filters)
+                    .order_by(Expense.date.desc(), Expense.id.desc())
+                    .offset((page - 1) * PER_PAGE).limit(PER_PAGE).all())
+        return render_template("expenses.html", expenses=expenses, total=total, category=category, start=start, end=end,
+                               page=page, pages=pages, count=count)
 
     @app.route("/add", methods=["GET", "POST"])
     def add_expense():
@@ -114,7 +276,7 @@ def create_app(test_config=None):
                 notes = request.form.get("notes", "").strip() or None
 
                 try:
-                    d = datetime.strptime(date_str, "%Y-%m-%d").date()
+                    d = _parse_ymd(date_str)
                 except ValueError:
                     flash("Invalid date. Use YYYY-MM-DD.", "danger")
                     return redirect(url_for("add_expense"))
@@ -130,14 +292,14 @@ def create_app(test_config=None):
                 e = Expense(date=d, amount=amount, category=category, merchant=merchant,
                             payment_method=payment_method, notes=notes)
                 session.add(e)
+                bump_data_version(session)
                 session.commit()
+                schedule_insights_refresh()
                 flash("Expense added!", "success")
                 return redirect(url_for("list_expenses"))
             except SQLAlchemyError as err:
                 session.rollback()
                 flash(f"Database error: {err}", "danger")
-            finally:
-                session.close()
         # GET
         suggested_date = date.today().strftime("%Y-%m-%d")
         return render_template("add_expense.html", today=suggested_date)
@@ -149,26 +311,38 @@ def create_app(test_config=None):
             e = session.get(Expense, expense_id)
             if e:
                 session.delete(e)
+                bump_data_version(session)
                 session.commit()
+                schedule_insights_refresh()
                 flash("Expense deleted.", "info")
             else:
                 flash("Expense not found.", "warning")
         except SQLAlchemyError as err:
             session.rollback()
             flash(f"Database error: {err}", "danger")
-        finally:
-            session.close()
         return redirect(url_for("list_expenses"))
 
     @app.route("/insights")
     def insights():
         session = get_session()
-        try:
-            expenses = session.query(Expense).all()
-            insights_data = generate_insights(expenses)
-            return render_template("insights.html", insights=insights_data, category_tips=category_tips)
-        finally:
-            session.close()
+        cached = session.get(InsightsCache, 1)
+        future = pending_refresh.get("future")
+        refreshing = future is not None and not future.done()
+        refresh_failed = future is not None and future.done() and future.exception() is not None
+        if cached.payload is None or refresh_failed:
+            # Nothing stored yet, or this process's last refresh failed and
+            # left the row stale: compute it now
+            payload = refresh_insights()
+            if refresh_failed and pending_refresh.get("future") is future:
+                del pending_refresh["future"]
+        else:
+            # One row read. If expenses changed since it was built, serve it
+            # anyway and let a refresh catch up rather than block the page
+            payload = cached.payload
+            if cached.payload_version != cached.data_version and not refreshing:
+                schedule_insights_refresh()
+        insights_data = json.loads(payload)
+        return render_template("insights.html", insights=insights_data, category_tips=category_tips)
 
     return app
 
@@ -0,0 +1,40 @@
+from ai import generate_insights
+
+
+def _rows(series, cat="Foo", start=202401):
+    # One (category, year_month, amount) row per month with spend; "Bar"
+    # spends every month so all months are on the shared axis
+    rows = [("Bar", start + i, 5.0) for i in range(len(series))]
+    rows += [(cat, start + i, v) for i, v in enumerate(series) if v]
+    return rows
+
+
+def test_flat_trend_forecasts_zero_without_note():
+    # Fits to exactly 0 next month; float residue must not add a $0.00 note
+    result = generate_insights(_rows([99.99, 0, 99.99, 0, 99.99, 0, 0]))
+    foo = result["per_category"]["Foo"]
+    assert foo["forecast_next"] == 0.0
+    assert foo["suggested_cap"] == 0.0
+    assert foo["notes"] == []
+
+
+def test_notes_match_baseline():
+    result = generate_insights(_rows([0, 99.99, 0, 99.99, 0, 99.99, 0, 0]))
+    assert result["per_category"]["Foo"]["notes"] == [
+        "Stay on track in Foo. Expected spend next month: $21.43."]
+
+    result = generate_insights(_rows([10, 20, 30, 40, 50, 60]))
+    assert result["per_category"]["Foo"]["notes"] == [
+        "Stay on track in Foo. Expected spend next month: $70.00.",
+        "Possible spike in Foo last month (z≈2.1). Review big charges.",
+    ]
+
+    result = generate_insights(_rows([50, 50, 50, 50, 50, 200]))
+    assert result["per_category"]["Foo"]["notes"] == [
+        "Last month in Foo was higher than trend. Aim for $135.00 next month."]
+
+
+def test_no_expenses():
+    result = generate_insights([])
+    assert result["per_category"] == {}
+    assert result["suggestions"] == ["Add expenses to unlock insights."]